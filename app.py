@@ -1,35 +1,106 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime
+from flask_compress import Compress
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import event, func, insert, inspect, text
+from sqlalchemy.exc import OperationalError
+from cachetools import LRUCache, TTLCache
+from datetime import datetime, timedelta
 import os
-import json
+import logging
+import orjson
+import threading
+import time
+import hashlib
+import re
+from functools import lru_cache
 from dotenv import load_dotenv
+import httpx
+import redis
 from openai import OpenAI
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional, Literal
 from enum import Enum
 
 # Load environment variables
 load_dotenv()
+logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler()])
 api_key = os.getenv("DEEPSEEK_API_KEY")
 base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+chat_model = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+
+class ORJSONProvider(JSONProvider):
+    """Serve jsonify() and request.json through orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=ORJSON_OPTIONS), mimetype="application/json")
+
 
 # Initialize Flask app
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
+# Compress buffered JSON bodies (history pages, exports). Streamed responses
+# (SSE replies, NDJSON history, text exports) stay uncompressed: the compressor
+# doesn't flush per chunk, so it would hold back the early bytes they exist for.
+app.config['COMPRESS_MIMETYPES'] = ["application/json"]
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_ALGORITHM'] = ["br", "gzip"]
+app.config['COMPRESS_STREAMS'] = False
+Compress(app)
+
 # Configure SQLite database
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chat_memory.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Bounded pool of reused connections, shared by the worker's greenlets. Sessions
+# are already scoped per app context (a contextvar, so greenlet-local under
+# gevent) and hold a connection only around their queries, never across the
+# LLM call; a small pool covers many in-flight requests. Fail fast rather than
+# queue for the default 30s if it ever runs dry.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    "pool_size": 10,
+    "max_overflow": 10,
+    "pool_timeout": 10,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+    "connect_args": {"check_same_thread": False}
+}
 db = SQLAlchemy(app)
 
-# Initialize DeepSeek client (OpenAI-compatible)
+# Initialize DeepSeek client (OpenAI-compatible) on one shared HTTP/2 pool so
+# worker threads reuse warm TLS connections instead of handshaking per burst.
+# Read timeout matches the gunicorn worker timeout; non-streamed replies send
+# nothing until the whole completion is done.
+http_client = httpx.Client(
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=300),
+    timeout=httpx.Timeout(120.0, connect=5.0),
+    http2=True
+)
 client = OpenAI(
     api_key=api_key,
-    base_url=base_url
+    base_url=base_url,
+    http_client=http_client
 )
 
+# Optional Redis, shared by all workers, for caching profile lookups
+redis_url = os.getenv("REDIS_URL")
+redis_client = redis.Redis.from_url(
+    redis_url, socket_timeout=1, socket_connect_timeout=1
+) if redis_url else None
+
 # ============================================
 # PYDANTIC MODELS FOR STRUCTURED OUTPUTS
 # ============================================
@@ -353,12 +424,24 @@ For follow-up questions (when gathering info):
 """
 }
 
+SUMMARY_PROMPT = """You maintain a running summary of a business consultation between a Kenyan user and "Biashara Buddy".
+Merge the existing summary with the new messages into one concise summary (max 250 words).
+Keep every concrete fact: capital, location, skills, interests, businesses discussed or chosen, numbers quoted, decisions made and open questions.
+Reply with the summary text only."""
+
 # ============================================
 # DATABASE MODELS
 # ============================================
 
 class ChatMessage(db.Model):
     """Stores chat messages"""
+    __table_args__ = (
+        # Newest-timestamp lookups for the session version; messages themselves are
+        # read in id (insertion) order, which ix_chat_message_session_id covers
+        # since SQLite indexes carry the rowid
+        db.Index("ix_chat_session_time", "session_id", "timestamp"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(64), nullable=False, index=True)
     role = db.Column(db.String(10), nullable=False)
@@ -379,20 +462,653 @@ class UserProfile(db.Model):
     risk_tolerance = db.Column(db.String(20), nullable=True)
     selected_business = db.Column(db.String(100), nullable=True)
     conversation_stage = db.Column(db.String(30), default="discovery")
+    conversation_summary = db.Column(db.Text, nullable=True)  # rolling summary of older messages
+    summary_message_count = db.Column(db.Integer, default=0)  # oldest messages covered by the summary
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class CachedResponse(db.Model):
+    """Assistant replies to opening questions, reused across sessions"""
+    id = db.Column(db.Integer, primary_key=True)
+    query_hash = db.Column(db.String(32), nullable=False, unique=True, index=True)
+    structured_data = db.Column(db.Text, nullable=False)  # JSON string of structured response
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # for purging expired rows
+
+# How long a locked write waits for the lock. SQLite waits inside C, so under
+# gevent workers the whole worker stalls meanwhile; gunicorn.conf.py lowers it
+# there, and writes that must not be lost go through _commit_with_retry.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL journaling so readers don't block the writer, and fewer fsyncs per commit"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _add_missing_columns(conn, model):
+    """Add columns introduced since the table was created (create_all won't alter it)"""
+    table = model.__table__
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
 # Ensure tables exist
 with app.app_context():
-    db.create_all()
-    print("Database tables created successfully.")
+    event.listen(db.engine, "connect", _set_sqlite_pragmas)
+    with db.engine.connect() as conn:
+        # Every worker runs this at import. Holding SQLite's exclusive lock for the
+        # whole check-then-create makes workers take turns, so a second one sees
+        # the finished schema instead of racing to create the same table/column.
+        # Nothing is being served yet, so wait out another worker's migration
+        # (an index build on a large table can take a while) instead of failing boot
+        conn.exec_driver_sql("PRAGMA busy_timeout=60000")
+        conn.exec_driver_sql("BEGIN EXCLUSIVE")
+        db.metadata.create_all(conn)
+        # create_all skips tables that already exist; add columns and indexes introduced since
+        _add_missing_columns(conn, UserProfile)
+        for model in (ChatMessage, CachedResponse):
+            for index in model.__table__.indexes:
+                index.create(conn, checkfirst=True)
+        conn.commit()
+        conn.exec_driver_sql(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    app.logger.info("Database tables created successfully.")
+
+def _dump_structured_data(response_dict):
+    """Compact JSON for the structured_data columns
+
+    Null fields are kept, so /api/history (which returns the stored JSON as-is)
+    gives a turn the same shape /api/query did. orjson writes it without
+    padding and as UTF-8 rather than escaping every non-ASCII character.
+    """
+    return orjson.dumps(response_dict).decode()
+
+
+# Retries for writes that follow a paid LLM call. Sleeping between attempts
+# (unlike SQLite's busy wait) yields to other greenlets under gevent.
+WRITE_RETRY_ATTEMPTS = 5
+WRITE_RETRY_DELAY = 0.1  # seconds, grows linearly per attempt
+
+
+def _commit_with_retry(stage):
+    """Run stage() and commit, retrying the whole transaction while the database is locked
+
+    stage must only stage writes in db.session, since a locked attempt is rolled
+    back and staged again. Returns whatever stage() returned.
+    """
+    for attempt in range(1, WRITE_RETRY_ATTEMPTS + 1):
+        try:
+            result = stage()
+            db.session.commit()
+            return result
+        except OperationalError as e:
+            db.session.rollback()
+            if "database is locked" not in str(e.orig) or attempt == WRITE_RETRY_ATTEMPTS:
+                raise
+            app.logger.warning("Database locked, retrying write (attempt %d)", attempt)
+            time.sleep(WRITE_RETRY_DELAY * attempt)
+
+# ============================================
+# SESSION HISTORY CACHE
+# ============================================
+
+# session_id -> (session version, newest [{"role", "content"}, ...]); only the
+# last HISTORY_MAX_VERBATIM messages are kept since older ones never reach the prompt
+SESSION_CACHE = LRUCache(maxsize=10_000)
+SESSION_CACHE_LOCK = threading.Lock()
+
+
+def _session_version(session_id):
+    """(message count, newest timestamp) - changes on every write to the session
+
+    Index-only on ix_chat_session_time. Unlike MAX(id) it can't repeat after a
+    reset, since SQLite reuses rowids but new rows always get later timestamps.
+    """
+    return tuple(db.session.query(func.count(ChatMessage.id), func.max(ChatMessage.timestamp))
+                 .filter_by(session_id=session_id).one())
+
+
+def _load_session_messages(session_id):
+    """Session version and the newest messages as role/content dicts, from memory when still current"""
+    # Catches writes made by other workers since we cached
+    version = _session_version(session_id)
+
+    # Hand out a copy taken under the lock: the cached list is extended in place
+    # by other requests' turns, and the caller slices it against this version
+    with SESSION_CACHE_LOCK:
+        cached = SESSION_CACHE.get(session_id)
+        if cached is not None and cached[0] == version:
+            return version, list(cached[1])
+
+    # Plain (role, content) rows; no ORM objects to hydrate and track. Read
+    # backwards by id, the order every endpoint uses, so long sessions cost the
+    # same. (A user row's timestamp is its arrival time, but it is inserted with
+    # the reply, so under overlapping turns timestamp order would interleave them.)
+    history = db.session.query(ChatMessage.role, ChatMessage.content) \
+        .filter_by(session_id=session_id).order_by(ChatMessage.id.desc()) \
+        .limit(HISTORY_MAX_VERBATIM).all()
+    messages = [{"role": role, "content": content} for role, content in reversed(history)]
+    with SESSION_CACHE_LOCK:
+        SESSION_CACHE[session_id] = (version, messages)
+    return version, list(messages)
+
+
+def _cache_session_messages(session_id, previous_version, version, new_messages):
+    """Append newly saved messages to the cached history if nothing else was written"""
+    with SESSION_CACHE_LOCK:
+        cached = SESSION_CACHE.get(session_id)
+        if cached is None:
+            return
+        if cached[0] != previous_version or version[0] != previous_version[0] + len(new_messages):
+            SESSION_CACHE.pop(session_id, None)
+            return
+        # Extend in place (readers get their own copy from _load_session_messages)
+        messages = cached[1]
+        messages.extend(new_messages)
+        del messages[:-HISTORY_MAX_VERBATIM]
+        SESSION_CACHE[session_id] = (version, messages)
+
+
+def _forget_session_messages(session_id):
+    with SESSION_CACHE_LOCK:
+        SESSION_CACHE.pop(session_id, None)
+
+# ============================================
+# PROFILE CACHE
+# ============================================
+
+# Fields clients may read and set through /api/profile
+UPDATABLE_PROFILE_FIELDS = (
+    "capital_available", "location_county", "location_type",
+    "time_commitment", "skills", "interests", "risk_tolerance",
+    "selected_business", "conversation_stage"
+)
+PROFILE_FIELDS = UPDATABLE_PROFILE_FIELDS + ("conversation_summary", "summary_message_count")
+PROFILE_COLUMNS = tuple(getattr(UserProfile, field) for field in PROFILE_FIELDS)
+PROFILE_CACHE_TTL = 300  # seconds
+
+# Profile used for a session's first turn, before its row exists
+NEW_PROFILE = {**dict.fromkeys(PROFILE_FIELDS), "conversation_stage": "discovery", "summary_message_count": 0}
+
+
+def _profile_cache_key(session_id):
+    return f"profile:{session_id}"
+
+
+def get_cached_profile(session_id):
+    """Profile fields as a dict (None if there is no profile), read through Redis when configured"""
+    if redis_client:
+        try:
+            cached = redis_client.get(_profile_cache_key(session_id))
+            if cached is not None:
+                return {**orjson.loads(cached), "is_new": False}
+        except redis.RedisError as e:
+            app.logger.warning("Profile cache read failed: %s", e)
+
+    # Just the cached fields, found through the unique session_id index; no ORM object to hydrate
+    row = db.session.query(*PROFILE_COLUMNS).filter_by(session_id=session_id).first()
+    if row is None:
+        return None
+    profile_dict = dict(zip(PROFILE_FIELDS, row))
+
+    if redis_client:
+        try:
+            redis_client.setex(_profile_cache_key(session_id), PROFILE_CACHE_TTL, orjson.dumps(profile_dict))
+        except redis.RedisError as e:
+            app.logger.warning("Profile cache write failed: %s", e)
+    return {**profile_dict, "is_new": False}
+
+
+def _invalidate_profile(session_id):
+    """Drop the cached profile; call after committing any profile change"""
+    if not redis_client:
+        return
+    try:
+        redis_client.delete(_profile_cache_key(session_id))
+    except redis.RedisError as e:
+        app.logger.warning("Profile cache invalidation failed: %s", e)
+
+# ============================================
+# CONVERSATION MEMORY
+# ============================================
+
+# Older messages are folded into UserProfile.conversation_summary so the prompt
+# stays bounded: a summary pass starts once more than HISTORY_SUMMARIZE_AT
+# messages are unsummarized and keeps the newest HISTORY_KEEP_RECENT verbatim.
+HISTORY_KEEP_RECENT = 20
+HISTORY_SUMMARIZE_AT = 30
+# Hard cap on verbatim messages in case summarization falls behind
+HISTORY_MAX_VERBATIM = 40
+
+SUMMARIZING = set()
+SUMMARIZING_LOCK = threading.Lock()
+
+
+def _memory_messages(profile, history, total):
+    """Summary of older turns (if any) followed by the unsummarized recent messages
+
+    history holds the newest messages of a session with total messages in all.
+    """
+    summarized = profile["summary_message_count"] or 0
+    skipped = total - len(history)
+    recent = history[max(summarized - skipped, len(history) - HISTORY_MAX_VERBATIM, 0):]
+    if not profile["conversation_summary"]:
+        return recent
+    return [{
+        "role": "system",
+        "content": f"## EARLIER CONVERSATION (SUMMARY)\n{profile['conversation_summary']}"
+    }, *recent]
+
+
+def _maybe_summarize(session_id, summarized, total):
+    """Start a background summary pass if too many messages are unsummarized"""
+    if total - summarized <= HISTORY_SUMMARIZE_AT:
+        return
+    with SUMMARIZING_LOCK:
+        if session_id in SUMMARIZING:
+            return
+        SUMMARIZING.add(session_id)
+    threading.Thread(target=_summarize_history, args=(session_id,), daemon=True).start()
+
+
+def _summarize_history(session_id):
+    """Fold all but the newest messages into the session's rolling summary"""
+    try:
+        with app.app_context():
+            profile = UserProfile.query.filter_by(session_id=session_id).first()
+            if not profile:
+                return
+            summarized = profile.summary_message_count or 0
+
+            total = db.session.query(func.count(ChatMessage.id)).filter_by(session_id=session_id).scalar()
+            upto = total - HISTORY_KEEP_RECENT
+            if upto <= summarized:
+                return
+
+            # Only the messages being folded in; the summary already covers the rest
+            history = db.session.query(ChatMessage.role, ChatMessage.content) \
+                .filter_by(session_id=session_id).order_by(ChatMessage.id) \
+                .offset(summarized).limit(upto - summarized).all()
+            transcript = "\n\n".join(f"{role.upper()}: {content}" for role, content in history)
+            response = client.chat.completions.create(
+                model=chat_model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": f"EXISTING SUMMARY:\n{profile.conversation_summary or 'None'}\n\nNEW MESSAGES:\n{transcript}"}
+                ],
+                temperature=0.3,
+                max_tokens=800
+            )
+
+            summary = response.choices[0].message.content.strip()
+
+            def stage():
+                profile.conversation_summary = summary
+                profile.summary_message_count = upto
+
+            _commit_with_retry(stage)
+            _invalidate_profile(session_id)
+    except Exception:
+        app.logger.exception("Summarizing conversation history failed")
+    finally:
+        with SUMMARIZING_LOCK:
+            SUMMARIZING.discard(session_id)
+
+# ============================================
+# RESPONSE CACHE
+# ============================================
+
+# Opening questions ("how much capital for a salon?") repeat across users. With
+# no history the prompt depends only on the profile block and the question, so
+# a reply to the same normalized question under the same profile is reused.
+RESPONSE_CACHE_TTL = timedelta(days=7)
+# Replies that only ask the user for details are not worth reusing
+UNCACHED_RESPONSE_TYPES = {"gathering_info"}
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize_message(user_message):
+    """Lowercase, punctuation-free, single-spaced form used to match repeated questions"""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", user_message.lower())).strip()
+
+
+# Replies depend on the model and the system prompt too; hashing both into every
+# key means a deploy that changes either stops serving the old answers. Hashed
+# once here and copied per key.
+_RESPONSE_CACHE_DIGEST = hashlib.blake2b(digest_size=16)
+_RESPONSE_CACHE_DIGEST.update(chat_model.encode())
+_RESPONSE_CACHE_DIGEST.update(b"\0")
+_RESPONSE_CACHE_DIGEST.update(SYSTEM_MESSAGE["content"].encode())
+_RESPONSE_CACHE_DIGEST.update(b"\0")
+
+
+def _response_cache_key(profile_message, user_message):
+    normalized = _normalize_message(user_message)
+    digest = _RESPONSE_CACHE_DIGEST.copy()
+    digest.update(profile_message["content"].encode())
+    digest.update(b"\0")
+    digest.update(normalized.encode())
+    return digest.hexdigest()
+
+
+def _get_cached_response(cache_key):
+    cached = CachedResponse.query.filter_by(query_hash=cache_key) \
+        .filter(CachedResponse.created_at > datetime.utcnow() - RESPONSE_CACHE_TTL).first()
+    return orjson.loads(cached.structured_data) if cached else None
+
+
+def _cache_response(cache_key, response_dict, structured_data):
+    """Stage a reply for the response cache; committed with the chat turn"""
+    if response_dict.get("response_type") in UNCACHED_RESPONSE_TYPES:
+        return
+    # Expired rows are never served again; drop them so the table stays bounded
+    CachedResponse.query.filter(CachedResponse.created_at <= datetime.utcnow() - RESPONSE_CACHE_TTL) \
+        .delete(synchronize_session=False)
+    cached = CachedResponse.query.filter_by(query_hash=cache_key).first()
+    if not cached:
+        cached = CachedResponse(query_hash=cache_key)
+        db.session.add(cached)
+    cached.structured_data = structured_data
+    cached.created_at = datetime.utcnow()
+
+
+# Replies for an exact (session, history state, message) turn, so a resubmitted
+# turn (retry after a failed save, a double submit racing the first) skips the
+# LLM. Keys are content-addressed by the session version, so without Redis a
+# per-worker cache is still never stale.
+TURN_CACHE_TTL = 3600  # seconds
+LOCAL_TURN_CACHE = TTLCache(maxsize=2048, ttl=TURN_CACHE_TTL)
+LOCAL_TURN_CACHE_LOCK = threading.Lock()
+
+
+def _turn_cache_key(session_id, version, user_message):
+    count, newest = version
+    raw = f"{session_id}|{count}|{newest}|{user_message}"
+    return "llm:" + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _get_turn_reply(turn_key):
+    if redis_client:
+        try:
+            cached = redis_client.get(turn_key)
+            return orjson.loads(cached) if cached is not None else None
+        except redis.RedisError as e:
+            app.logger.warning("Turn cache read failed: %s", e)
+            return None
+    with LOCAL_TURN_CACHE_LOCK:
+        return LOCAL_TURN_CACHE.get(turn_key)
+
+
+def _cache_turn_reply(turn_key, response_dict, structured_data):
+    if redis_client:
+        try:
+            redis_client.setex(turn_key, TURN_CACHE_TTL, structured_data)
+        except redis.RedisError as e:
+            app.logger.warning("Turn cache write failed: %s", e)
+        return
+    with LOCAL_TURN_CACHE_LOCK:
+        LOCAL_TURN_CACHE[turn_key] = response_dict
+
+
+# ============================================
+# CANNED REPLIES
+# ============================================
+
+# A brand-new session that opens with a bare greeting or "what can you do?"
+# gets the same welcome every time; answer it locally instead of calling the LLM.
+WELCOME_REPLY = AssistantResponse(
+    message=(
+        "Karibu! I'm Biashara Buddy, your business consultant for Kenya. I can help you "
+        "find the right business for your budget, plan a detailed startup budget, figure "
+        "out which licenses and permits you need, find suppliers, and map out your "
+        "first weeks of operation. To get started, tell me a bit about yourself."
+    ),
+    response_type="greeting",
+    follow_up_questions=[
+        FollowUpQuestion(
+            question="How much money can you invest to start?",
+            why_asking="Your capital decides which businesses are realistic for you",
+            options=["Under KES 30,000", "KES 30,000 - 100,000", "KES 100,000 - 500,000", "Over KES 500,000"]
+        ),
+        FollowUpQuestion(
+            question="Which county are you in, and is it an urban or rural area?",
+            why_asking="Permit costs, rent and customer demand vary by location"
+        ),
+        FollowUpQuestion(
+            question="Will this be full-time or a side hustle?",
+            why_asking="Some businesses need you there every day",
+            options=["Full-time", "Part-time / side hustle"]
+        )
+    ],
+    next_suggested_topic="Your capital, location and available time"
+).model_dump()
+
+# Normalized (see _normalize_message) openers that get WELCOME_REPLY
+WELCOME_MESSAGES = frozenset({
+    "hi", "hello", "hey", "hi there", "hello there", "hey there",
+    "good morning", "good afternoon", "good evening",
+    "habari", "habari yako", "hujambo", "jambo", "mambo", "sasa", "niaje",
+    "help", "what can you do", "what do you do", "how can you help", "how can you help me"
+})
+
+
+def _canned_reply(user_message, history, profile):
+    """Prebuilt reply for a new session's greeting or help request, else None"""
+    if history or not profile["is_new"]:
+        return None
+    return WELCOME_REPLY if _normalize_message(user_message) in WELCOME_MESSAGES else None
 
 # ============================================
 # API ROUTES
 # ============================================
 
+MAX_HISTORY_PAGE = 500
+
+def _request_reply(messages, stream=False):
+    """Ask the model for the next assistant reply as a JSON object"""
+    return client.chat.completions.create(
+        model=chat_model,
+        messages=messages,
+        response_format={"type": "json_object"},
+        temperature=0.7,
+        max_tokens=4096,
+        stream=stream
+    )
+
+
+def _parse_assistant_reply(response_text):
+    """Parse and validate the model's JSON reply
+
+    Returns (response_dict, validated); validated is False when the reply had to
+    fall back to the raw or partially-parsed text.
+    """
+    # Parse + validate in a single pass through pydantic-core
+    try:
+        return AssistantResponse.model_validate_json(response_text).model_dump(), True
+    except ValidationError as validation_error:
+        app.logger.warning("Validation warning: %s", validation_error)
+
+    try:
+        response_dict = orjson.loads(response_text)
+    except orjson.JSONDecodeError:
+        # Fallback if JSON parsing fails
+        return {
+            "message": response_text,
+            "response_type": "general_advice"
+        }, False
+
+    # Continue with unvalidated response if validation fails
+    if not isinstance(response_dict, dict):
+        response_dict = {"response_type": "general_advice"}
+    if "message" not in response_dict:
+        response_dict["message"] = response_text
+    return response_dict, False
+
+
+def _message_row(user_msg, role, content, structured_data=None):
+    """Column values for one chat_message row of the turn that user_msg opened"""
+    return {
+        "session_id": user_msg.session_id,
+        "role": role,
+        "content": content,
+        "structured_data": structured_data,
+        "timestamp": user_msg.timestamp if role == "user" else datetime.utcnow()
+    }
+
+
+def _insert_messages(rows):
+    """Write a turn's messages with one multi-row INSERT instead of one per ORM object"""
+    db.session.execute(insert(ChatMessage).values(rows))
+
+
+def _save_turn(profile, user_msg, response_dict, structured_data, previous_version, cache_key=None):
+    """Persist the user message, assistant reply and (if new) profile in a single transaction
+
+    structured_data is response_dict already serialized by _dump_structured_data.
+    With a cache_key the reply is also stored in the response cache, in the same
+    transaction.
+    """
+    rows = [
+        _message_row(user_msg, "user", user_msg.content),
+        _message_row(user_msg, "assistant", response_dict.get("message", ""), structured_data)
+    ]
+    new_messages = [{"role": row["role"], "content": row["content"]} for row in rows]
+    session_id = user_msg.session_id
+
+    def stage():
+        if cache_key:
+            _cache_response(cache_key, response_dict, structured_data)
+        if profile["is_new"]:
+            # Another request may have created it meanwhile; keep whichever came first
+            db.session.execute(sqlite_insert(UserProfile).values(
+                session_id=session_id, conversation_stage="discovery"
+            ).on_conflict_do_nothing(index_elements=["session_id"]))
+        _insert_messages(rows)
+        return _session_version(session_id)
+
+    summarized = profile["summary_message_count"] or 0
+    version = _commit_with_retry(stage)
+    _cache_session_messages(session_id, previous_version, version, new_messages)
+    if profile["is_new"]:
+        _invalidate_profile(session_id)
+    _maybe_summarize(session_id, summarized, version[0])
+
+
+def _save_failed_turn(user_msg, previous_version):
+    """Keep the user's message even when the LLM call fails"""
+    try:
+        db.session.rollback()
+        new_messages = [{"role": "user", "content": user_msg.content}]
+
+        def stage():
+            _insert_messages([_message_row(user_msg, "user", user_msg.content)])
+            return _session_version(user_msg.session_id)
+
+        version = _commit_with_retry(stage)
+        _cache_session_messages(user_msg.session_id, previous_version, version, new_messages)
+    except Exception:
+        db.session.rollback()
+
+
+@lru_cache(maxsize=4096)
+def _format_profile_context(capital, county, location_type, time_commitment,
+                            skills, interests, risk_tolerance, selected_business, stage):
+    """Build (once per distinct profile) the system message describing the user"""
+    return {
+        "role": "system",
+        "content": f"""## CURRENT USER PROFILE
+- Capital: {capital or 'Unknown'}
+- Location: {county or 'Unknown'} ({location_type or 'Unknown'})
+- Time: {time_commitment or 'Unknown'}
+- Skills: {skills or 'Unknown'}
+- Interests: {interests or 'Unknown'}
+- Risk Tolerance: {risk_tolerance or 'Unknown'}
+- Selected Business: {selected_business or 'None yet'}
+- Conversation Stage: {stage}
+"""
+    }
+
+
+def _profile_context_message(profile):
+    """Profile system message; the returned dict is shared, never mutate it"""
+    return _format_profile_context(
+        profile["capital_available"], profile["location_county"], profile["location_type"],
+        profile["time_commitment"], profile["skills"], profile["interests"],
+        profile["risk_tolerance"], profile["selected_business"], profile["conversation_stage"]
+    )
+
+
+def _profile_summary(profile):
+    """Short profile block returned alongside each chat response"""
+    return {
+        "stage": profile["conversation_stage"],
+        "capital": profile["capital_available"],
+        "location": profile["location_county"],
+        "selected_business": profile["selected_business"]
+    }
+
+
+def _sse(payload):
+    return b"data: " + orjson.dumps(payload, option=ORJSON_OPTIONS) + b"\n\n"
+
+
+def _stream_reply(user_msg, messages, profile, previous_version, cache_key, turn_key):
+    """Yield Server-Sent Events with token deltas, then the final structured response"""
+    saved = False
+    try:
+        stream = _request_reply(messages, stream=True)
+
+        chunks = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    yield _sse({"delta": delta})
+        finally:
+            # Also runs when the client disconnects, so DeepSeek stops generating
+            stream.close()
+
+        response_dict, validated = _parse_assistant_reply("".join(chunks))
+        # Serialized once for the DB row and both caches
+        structured_data = _dump_structured_data(response_dict)
+        # A truncated or off-schema reply is saved for this turn but never reused
+        if not validated:
+            cache_key = None
+        else:
+            _cache_turn_reply(turn_key, response_dict, structured_data)
+        _save_turn(profile, user_msg, response_dict, structured_data, previous_version, cache_key)
+        saved = True
+
+        yield _sse({"done": True, "response": response_dict, "profile": _profile_summary(profile)})
+
+    except GeneratorExit:
+        # Client went away mid-reply; still keep what the user asked
+        if not saved:
+            _save_failed_turn(user_msg, previous_version)
+        raise
+
+    except Exception as e:
+        app.logger.exception("Streaming reply failed")
+        _save_failed_turn(user_msg, previous_version)
+        yield _sse({"error": f"Failed to process request: {str(e)}"})
+
+
 @app.route("/api/query", methods=["POST"])
 def query_openai():
-    """Main chat endpoint with structured outputs"""
+    """Main chat endpoint with structured outputs
+
+    Send "stream": true to receive the reply as Server-Sent Events:
+    {"delta": ...} events while the model generates, then a final
+    {"done": true, "response": ..., "profile": ...} event.
+    """
     try:
         data = request.json
         session_id = data.get("session_id")
@@ -401,100 +1117,83 @@ def query_openai():
         if not user_message or not session_id:
             return jsonify({"error": "Missing message or session_id"}), 400
 
-        # Save user message
-        db.session.add(ChatMessage(
+        # User message is saved together with the reply once the LLM returns
+        user_msg = ChatMessage(
             session_id=session_id,
             role="user",
-            content=user_message
-        ))
-        db.session.commit()
-
-        # Get or create user profile
-        profile = UserProfile.query.filter_by(session_id=session_id).first()
-        if not profile:
-            profile = UserProfile(session_id=session_id)
-            db.session.add(profile)
-            db.session.commit()
+            content=user_message,
+            timestamp=datetime.utcnow()
+        )
 
         # Build conversation history
-        history = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp).all()
-
-        # Include profile context in system message
-        profile_context = f"""
-## CURRENT USER PROFILE
-- Capital: {profile.capital_available or 'Unknown'}
-- Location: {profile.location_county or 'Unknown'} ({profile.location_type or 'Unknown'})
-- Time: {profile.time_commitment or 'Unknown'}
-- Skills: {profile.skills or 'Unknown'}
-- Interests: {profile.interests or 'Unknown'}
-- Risk Tolerance: {profile.risk_tolerance or 'Unknown'}
-- Selected Business: {profile.selected_business or 'None yet'}
-- Conversation Stage: {profile.conversation_stage}
-"""
-
-        system_with_context = {
-            "role": "system",
-            "content": SYSTEM_MESSAGE["content"] + profile_context
-        }
-
-        messages = [system_with_context] + [
-            {"role": msg.role, "content": msg.content}
-            for msg in history
-        ]
+        previous_version, history = _load_session_messages(session_id)
+
+        # Get or create user profile (a new one is saved with the chat turn, so
+        # nothing holds the SQLite write lock while the LLM is generating)
+        profile = get_cached_profile(session_id) or {**NEW_PROFILE, "is_new": True}
+
+        # Profile context goes in its own system message just before the new
+        # user turn, so the static system prompt plus the earlier history stay a
+        # byte-identical prefix that the provider can serve from its prompt cache
+        profile_message = _profile_context_message(profile)
+
+        # A new session's greeting has a canned reply; other opening questions
+        # may already have an answer from another session, and a resubmitted
+        # turn may already have one from its first attempt
+        cache_key = None if history else _response_cache_key(profile_message, user_message)
+        turn_key = _turn_cache_key(session_id, previous_version, user_message)
+        cached_response = _canned_reply(user_message, history, profile) \
+            or (_get_cached_response(cache_key) if cache_key else None) or _get_turn_reply(turn_key)
+        if cached_response is not None:
+            _save_turn(profile, user_msg, cached_response, _dump_structured_data(cached_response),
+                       previous_version)
+            payload = {"response": cached_response, "profile": _profile_summary(profile)}
+            if data.get("stream"):
+                return Response(_sse({"done": True, **payload}), mimetype="text/event-stream")
+            return jsonify(payload)
+
+        # Older turns are replaced by a rolling summary to bound prompt size
+        messages = [SYSTEM_MESSAGE, *_memory_messages(profile, history, previous_version[0]),
+                    profile_message, {"role": "user", "content": user_message}]
+
+        # End the read transaction so the pooled DB connection isn't held for
+        # the whole LLM call
+        db.session.close()
+
+        if data.get("stream"):
+            return Response(
+                stream_with_context(_stream_reply(user_msg, messages, profile, previous_version, cache_key, turn_key)),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
 
         # Call DeepSeek with JSON mode
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=0.7,
-            max_tokens=4096
-        )
+        try:
+            response = _request_reply(messages)
+        except Exception:
+            _save_failed_turn(user_msg, previous_version)
+            raise
 
         # Parse the JSON response
-        response_text = response.choices[0].message.content
-
-        try:
-            response_dict = json.loads(response_text)
-        except json.JSONDecodeError:
-            # Fallback if JSON parsing fails
-            response_dict = {
-                "message": response_text,
-                "response_type": "general_advice"
-            }
-
-        # Validate with Pydantic (optional, for data consistency)
-        try:
-            validated_response = AssistantResponse(**response_dict)
-            response_dict = validated_response.model_dump()
-        except Exception as validation_error:
-            print(f"Validation warning: {validation_error}")
-            # Continue with unvalidated response if validation fails
-            if "message" not in response_dict:
-                response_dict["message"] = response_text
-
-        # Save assistant message with structured data
-        db.session.add(ChatMessage(
-            session_id=session_id,
-            role="assistant",
-            content=response_dict.get("message", ""),
-            structured_data=json.dumps(response_dict)
-        ))
-        db.session.commit()
+        response_dict, validated = _parse_assistant_reply(response.choices[0].message.content)
+        # Serialized once for the DB row and both caches
+        structured_data = _dump_structured_data(response_dict)
+        # A truncated or off-schema reply is saved for this turn but never reused
+        if not validated:
+            cache_key = None
+        else:
+            _cache_turn_reply(turn_key, response_dict, structured_data)
+
+        # Save user and assistant messages (and the cached reply) in one commit
+        _save_turn(profile, user_msg, response_dict, structured_data, previous_version, cache_key)
 
         return jsonify({
             "response": response_dict,
-            "profile": {
-                "stage": profile.conversation_stage,
-                "capital": profile.capital_available,
-                "location": profile.location_county,
-                "selected_business": profile.selected_business
-            }
+            "profile": _profile_summary(profile)
         })
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("query_openai failed")
         return jsonify({"error": f"Failed to process request: {str(e)}"}), 500
 
 
@@ -505,22 +1204,12 @@ def get_profile():
     if not session_id:
         return jsonify({"error": "Missing session_id"}), 400
 
-    profile = UserProfile.query.filter_by(session_id=session_id).first()
+    profile = get_cached_profile(session_id)
     if not profile:
         return jsonify({"profile": None})
 
     return jsonify({
-        "profile": {
-            "capital_available": profile.capital_available,
-            "location_county": profile.location_county,
-            "location_type": profile.location_type,
-            "time_commitment": profile.time_commitment,
-            "skills": profile.skills,
-            "interests": profile.interests,
-            "risk_tolerance": profile.risk_tolerance,
-            "selected_business": profile.selected_business,
-            "conversation_stage": profile.conversation_stage
-        }
+        "profile": {field: profile[field] for field in UPDATABLE_PROFILE_FIELDS}
     })
 
 
@@ -533,28 +1222,24 @@ def update_profile():
         if not session_id:
             return jsonify({"error": "Missing session_id"}), 400
 
-        profile = UserProfile.query.filter_by(session_id=session_id).first()
-        if not profile:
-            profile = UserProfile(session_id=session_id)
-            db.session.add(profile)
-
-        # Update fields if provided
-        updatable_fields = [
-            'capital_available', 'location_county', 'location_type',
-            'time_commitment', 'skills', 'interests', 'risk_tolerance',
-            'selected_business', 'conversation_stage'
-        ]
-
-        for field in updatable_fields:
-            if field in data:
-                setattr(profile, field, data[field])
-
+        # Update fields if provided, creating the profile if needed, in one upsert
+        # on the unique session_id instead of a lookup followed by a write
+        values = {field: data[field] for field in UPDATABLE_PROFILE_FIELDS if field in data}
+        upsert = sqlite_insert(UserProfile).values(session_id=session_id, **values)
+        if values:
+            # ON CONFLICT updates don't run Column.onupdate; set it by hand
+            upsert = upsert.on_conflict_do_update(
+                index_elements=["session_id"], set_={**values, "updated_at": datetime.utcnow()}
+            )
+        else:
+            upsert = upsert.on_conflict_do_nothing(index_elements=["session_id"])
+        db.session.execute(upsert)
         db.session.commit()
+        _invalidate_profile(session_id)
         return jsonify({"message": "Profile updated successfully"})
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("update_profile failed")
         return jsonify({"error": "Failed to update profile"}), 500
 
 
@@ -566,86 +1251,137 @@ def reset_session():
         if not session_id:
             return jsonify({"error": "Missing session_id"}), 400
 
-        ChatMessage.query.filter_by(session_id=session_id).delete()
-        UserProfile.query.filter_by(session_id=session_id).delete()
+        # Plain DELETEs; the rows are never needed in the session afterwards
+        ChatMessage.query.filter_by(session_id=session_id).delete(synchronize_session=False)
+        UserProfile.query.filter_by(session_id=session_id).delete(synchronize_session=False)
         db.session.commit()
+        _forget_session_messages(session_id)
+        _invalidate_profile(session_id)
 
         return jsonify({"message": "Session reset successfully"})
 
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        app.logger.exception("reset_session failed")
         return jsonify({"error": "Failed to reset session"}), 500
 
 
+def _history_entry(msg):
+    entry = {
+        "id": msg.id,
+        "timestamp": msg.timestamp,
+        "role": msg.role,
+        "content": msg.content
+    }
+    if msg.structured_data:
+        # Already JSON; spliced into the output as-is rather than parsed and re-encoded
+        entry["structured_data"] = orjson.Fragment(msg.structured_data)
+    return entry
+
+
 @app.route("/api/history", methods=["GET"])
 def get_history():
-    """Get chat history with structured data"""
+    """Get chat history with structured data
+
+    Supports keyset pagination with ?after_id=<last id seen>&limit=<n>, and
+    ?format=ndjson to stream one JSON message per line instead of one document.
+    """
     session_id = request.args.get("session_id")
     if not session_id:
         return jsonify({"error": "Missing session_id"}), 400
 
-    history = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp).all()
+    after_id = request.args.get("after_id", 0, type=int)
+    limit = request.args.get("limit", type=int)
+
+    query = db.session.query(
+        ChatMessage.id, ChatMessage.timestamp, ChatMessage.role,
+        ChatMessage.content, ChatMessage.structured_data
+    ).filter_by(session_id=session_id).filter(ChatMessage.id > after_id).order_by(ChatMessage.id)
+    if limit:
+        query = query.limit(min(max(limit, 1), MAX_HISTORY_PAGE))
+
+    if request.args.get("format") == "ndjson":
+        def generate():
+            for msg in query.yield_per(200):
+                yield orjson.dumps(_history_entry(msg), option=ORJSON_OPTIONS) + b"\n"
 
-    formatted = []
-    for msg in history:
-        entry = {
-            "timestamp": msg.timestamp.isoformat(),
-            "role": msg.role,
-            "content": msg.content
-        }
-        if msg.structured_data:
-            entry["structured_data"] = json.loads(msg.structured_data)
-        formatted.append(entry)
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
-    return jsonify({"messages": formatted})
+    formatted = [_history_entry(msg) for msg in query]
+    return jsonify({
+        "messages": formatted,
+        "last_id": formatted[-1]["id"] if formatted else after_id
+    })
+
+
+def _export_lines(session_id, profile):
+    """Yield the export text line by line, reading messages in batches"""
+    yield "=" * 50
+    yield "BIASHARA BUDDY - BUSINESS CONSULTATION EXPORT"
+    yield "=" * 50
+    yield f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC"
+    yield ""
+
+    if profile:
+        yield "USER PROFILE:"
+        yield f"  Capital: {profile['capital_available'] or 'Not specified'}"
+        yield f"  Location: {profile['location_county'] or 'Not specified'}"
+        yield f"  Selected Business: {profile['selected_business'] or 'Not selected'}"
+        yield ""
+
+    yield "CONVERSATION:"
+    yield "-" * 50
+
+    # Plain (role, content, timestamp) rows: no ORM objects to hydrate, and
+    # structured_data (the bulk of each assistant row) is never read
+    history = db.session.query(ChatMessage.role, ChatMessage.content, ChatMessage.timestamp) \
+        .filter_by(session_id=session_id).order_by(ChatMessage.id).yield_per(100)
+    for role, content, timestamp in history:
+        prefix = "YOU" if role == "user" else "BIASHARA BUDDY"
+        yield f"\n[{prefix}] ({timestamp.strftime('%H:%M')})"
+        yield content
 
 
 @app.route("/api/export", methods=["POST"])
 def export_session():
-    """Export conversation as formatted text"""
-    session_id = request.json.get("session_id")
+    """Export conversation as formatted text
+
+    Send "format": "text" to stream the export as text/plain instead of
+    returning it inside a JSON document.
+    """
+    data = request.json
+    session_id = data.get("session_id")
     if not session_id:
         return jsonify({"error": "Missing session_id"}), 400
 
-    history = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.timestamp).all()
-    if not history:
+    has_messages = db.session.query(ChatMessage.id).filter_by(session_id=session_id).first()
+    if not has_messages:
         return jsonify({"error": "No messages found"}), 404
 
-    profile = UserProfile.query.filter_by(session_id=session_id).first()
-
-    export_lines = ["=" * 50]
-    export_lines.append("BIASHARA BUDDY - BUSINESS CONSULTATION EXPORT")
-    export_lines.append("=" * 50)
-    export_lines.append(f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC")
-    export_lines.append("")
+    profile = get_cached_profile(session_id)
+    lines = _export_lines(session_id, profile)
 
-    if profile:
-        export_lines.append("USER PROFILE:")
-        export_lines.append(f"  Capital: {profile.capital_available or 'Not specified'}")
-        export_lines.append(f"  Location: {profile.location_county or 'Not specified'}")
-        export_lines.append(f"  Selected Business: {profile.selected_business or 'Not selected'}")
-        export_lines.append("")
+    if data.get("format") == "text":
+        return Response(
+            stream_with_context(line + "\n" for line in lines),
+            mimetype="text/plain; charset=utf-8"
+        )
 
-    export_lines.append("CONVERSATION:")
-    export_lines.append("-" * 50)
+    return jsonify({"text": "\n".join(lines)})
 
-    for msg in history:
-        prefix = "YOU" if msg.role == "user" else "BIASHARA BUDDY"
-        export_lines.append(f"\n[{prefix}] ({msg.timestamp.strftime('%H:%M')})")
-        export_lines.append(msg.content)
 
-    return jsonify({"text": "\n".join(export_lines)})
+# Serialized once; a fresh Response is still built per request since after_request
+# hooks (CORS) add headers to whatever object is returned
+HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "service": "Biashara Buddy API",
+    "version": "2.0.0"
+})
 
 
 @app.route("/api/health", methods=["GET"])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        "status": "healthy",
-        "service": "Biashara Buddy API",
-        "version": "2.0.0"
-    })
+    return Response(HEALTH_BODY, mimetype="application/json")
 
 
 # Run locally
@@ -0,0 +1,28 @@
+import os
+
+# Cooperative gevent workers: the worker monkey-patches sockets before the app
+# is imported, so each LLM call just parks its greenlet and one process can
+# hold hundreds of in-flight chat requests and open SSE streams. Set
+# GUNICORN_WORKER_CLASS=gthread to fall back to threaded workers.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+# Only used by gthread workers
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+
+# Trade-off: SQLite runs in C and never yields to gevent, so a write waiting on
+# the database lock (held by the other worker or a summary pass) freezes every
+# greenlet in its worker, open SSE streams included, until the lock frees or
+# busy_timeout runs out. Write transactions here last milliseconds, so under
+# gevent cap the wait well below app.py's 5s default. The writes that follow a
+# paid LLM call (saving a turn, a summary) then retry with a sleeping backoff
+# that lets other greenlets run, rather than failing after the reply exists.
+if worker_class == "gevent":
+    os.environ.setdefault("SQLITE_BUSY_TIMEOUT_MS", "500")
+
+# Bind to the platform-provided port
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# LLM replies can take a while; don't kill workers mid-generation
+timeout = 120
+keepalive = 5